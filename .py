@@ -9,52 +9,94 @@ Features:
 - Minimal HTML UI rendered from templates (all in one file)
 
 Run:
-1. Install Flask: pip install flask
+1. Install Flask: pip install flask (optionally orjson for faster JSON API responses)
 2. Run: python flask_sqlite.py
 3. Open http://127.0.0.1:5000 in your browser
 
 This is a simple demo suitable for learning and small use. For production, split files, use SQLAlchemy, add auth, validation, and tests.
 """
-from flask import Flask, g, request, redirect, url_for, render_template_string, flash
+from flask import Flask, g, request, redirect, url_for, render_template, stream_template, flash, get_flashed_messages, make_response
+from jinja2 import ChoiceLoader, DictLoader, FileSystemBytecodeCache
+from markupsafe import Markup, escape
 import sqlite3
 from datetime import datetime
 import os
+import queue
+import threading
+import json
+import csv
+import io
+from functools import wraps
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 DATABASE = 'library.db'
+JINJA_CACHE_DIR = '.jinja_cache'
+POOL_SIZE = 5
 app = Flask(__name__)
 app.secret_key = 'replace-with-a-secure-key'
 
 # ----------------- Database helpers -----------------
 
+# Idle connections, checked out by get_db() and handed back on teardown so
+# requests don't reopen the database file each time.
+_POOL = queue.Queue(maxsize=POOL_SIZE)
+_INIT_LOCK = threading.Lock()
+
+def connect_db():
+    db = sqlite3.connect(DATABASE, check_same_thread=False, isolation_level=None, cached_statements=256)
+    db.row_factory = sqlite3.Row
+    db.executescript('''
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;
+    PRAGMA cache_size=-20000;
+    ''')
+    with _INIT_LOCK:
+        init_db(db)
+    return db
+
+
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        need_init = not os.path.exists(DATABASE)
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
-        if need_init:
-            init_db(db)
+        try:
+            db = _POOL.get_nowait()
+        except queue.Empty:
+            db = connect_db()
+        g._database = db
     return db
 
 
 def init_db(db):
+    # Safe to run on every new connection: only missing objects are created.
+    # Writes below run only when something is missing, so a connection opened
+    # against an up-to-date database never needs the write lock.
+    has_fts = db.execute("SELECT 1 FROM sqlite_master WHERE name='books_fts'").fetchone()
+    has_version = db.execute("SELECT 1 FROM sqlite_master WHERE name='db_version'").fetchone()
+    has_members_version = db.execute("SELECT 1 FROM sqlite_master WHERE name='members_version'").fetchone()
     cur = db.cursor()
     cur.executescript('''
-    CREATE TABLE books (
+    CREATE TABLE IF NOT EXISTS books (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         title TEXT NOT NULL,
         author TEXT,
         isbn TEXT UNIQUE,
-        copies INTEGER DEFAULT 1
+        copies INTEGER DEFAULT 1,
+        on_loan INTEGER DEFAULT 0
     );
 
-    CREATE TABLE members (
+    CREATE TABLE IF NOT EXISTS members (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
         email TEXT UNIQUE
     );
 
-    CREATE TABLE loans (
+    CREATE TABLE IF NOT EXISTS loans (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         book_id INTEGER NOT NULL,
         member_id INTEGER NOT NULL,
@@ -63,14 +105,85 @@ def init_db(db):
         FOREIGN KEY(book_id) REFERENCES books(id),
         FOREIGN KEY(member_id) REFERENCES members(id)
     );
+    CREATE INDEX IF NOT EXISTS idx_loans_borrowed_on ON loans(borrowed_on DESC);
+
+    CREATE TABLE IF NOT EXISTS db_version (version INTEGER NOT NULL);
+
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(title, author, isbn, content='books', content_rowid='id');
+    CREATE TRIGGER IF NOT EXISTS books_ai AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author, isbn) VALUES (new.id, new.title, new.author, new.isbn);
+    END;
+    CREATE TRIGGER IF NOT EXISTS books_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, isbn) VALUES ('delete', old.id, old.title, old.author, old.isbn);
+    END;
+    CREATE TRIGGER IF NOT EXISTS books_au AFTER UPDATE OF title, author, isbn ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, isbn) VALUES ('delete', old.id, old.title, old.author, old.isbn);
+        INSERT INTO books_fts(rowid, title, author, isbn) VALUES (new.id, new.title, new.author, new.isbn);
+    END;
+
+    CREATE VIRTUAL TABLE IF NOT EXISTS members_fts USING fts5(name, email, content='members', content_rowid='id');
+    CREATE TRIGGER IF NOT EXISTS members_ai AFTER INSERT ON members BEGIN
+        INSERT INTO members_fts(rowid, name, email) VALUES (new.id, new.name, new.email);
+    END;
+    CREATE TRIGGER IF NOT EXISTS members_ad AFTER DELETE ON members BEGIN
+        INSERT INTO members_fts(members_fts, rowid, name, email) VALUES ('delete', old.id, old.name, old.email);
+    END;
+    CREATE TRIGGER IF NOT EXISTS members_au AFTER UPDATE OF name, email ON members BEGIN
+        INSERT INTO members_fts(members_fts, rowid, name, email) VALUES ('delete', old.id, old.name, old.email);
+        INSERT INTO members_fts(rowid, name, email) VALUES (new.id, new.name, new.email);
+    END;
+
+    -- Moves only with the members table, in the same transaction as the change.
+    CREATE TABLE IF NOT EXISTS members_version (version INTEGER NOT NULL);
+    CREATE TRIGGER IF NOT EXISTS members_version_ai AFTER INSERT ON members BEGIN
+        UPDATE members_version SET version = version + 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS members_version_ad AFTER DELETE ON members BEGIN
+        UPDATE members_version SET version = version + 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS members_version_au AFTER UPDATE ON members BEGIN
+        UPDATE members_version SET version = version + 1;
+    END;
     ''')
+    if not has_version:
+        db.execute('INSERT INTO db_version (version) VALUES (0)')
+    if not has_members_version:
+        db.execute('INSERT INTO members_version (version) VALUES (0)')
+    if 'on_loan' not in {col['name'] for col in db.execute('PRAGMA table_info(books)')}:
+        # Databases created before the counter existed: add it and backfill it.
+        cur.executescript('''
+        ALTER TABLE books ADD COLUMN on_loan INTEGER DEFAULT 0;
+        UPDATE books SET on_loan = (SELECT COUNT(*) FROM loans WHERE loans.book_id = books.id AND returned_on IS NULL);
+        ''')
+    if db.execute("SELECT 1 FROM sqlite_master WHERE name='idx_loans_book_active'").fetchone():
+        # Superseded by books.on_loan; it only slowed down loan writes.
+        db.execute('DROP INDEX idx_loans_book_active')
+    if not has_fts:
+        # Index rows that were added before the full-text tables existed.
+        cur.executescript('''
+        INSERT INTO books_fts(books_fts) VALUES ('rebuild');
+        INSERT INTO members_fts(members_fts) VALUES ('rebuild');
+        ''')
     db.commit()
 
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
+        if g.pop('_dirty', False):
+            # Writes made by this request are committed (or discarded) together.
+            if exception is None:
+                db.commit()
+            else:
+                db.rollback()
+        release_db(db)
+
+
+def release_db(db):
+    try:
+        _POOL.put_nowait(db)
+    except queue.Full:
         db.close()
 
 # ----------------- Utility functions -----------------
@@ -82,44 +195,124 @@ def query_db(query, args=(), one=False):
     return (rv[0] if rv else None) if one else rv
 
 
-def execute_db(query, args=()):
+def iter_db(query, args=()):
+    # Return the cursor itself so callers (and templates) can iterate rows
+    # without materialising them into a list first.
+    return get_db().execute(query, args)
+
+
+def begin_db():
+    # Open this request's write transaction on first use; it is committed on teardown.
     db = get_db()
-    cur = db.cursor()
-    cur.execute(query, args)
-    db.commit()
-    return cur.lastrowid
+    if not g.get('_dirty'):
+        db.execute('BEGIN IMMEDIATE')
+        # Every write transaction bumps the version, which keys the ETags below.
+        db.execute('UPDATE db_version SET version = version + 1')
+        g._dirty = True
+    return db
+
+
+def execute_db(query, args=()):
+    cur = begin_db().execute(query, args)
+    return cur.rowcount
+
+
+def executemany_db(query, seq_of_args):
+    cur = begin_db().executemany(query, seq_of_args)
+    return cur.rowcount
+
+
+def db_version():
+    # Bumped by every write transaction (see begin_db), so anything built from
+    # the database at version N is still current while it reads N.
+    return query_db('SELECT version FROM db_version', one=True)['version']
+
+
+def etag_cached(view):
+    # Answer If-None-Match with 304 until the next committed write, skipping
+    # the query and rendering entirely.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = f'{request.endpoint}-{db_version()}'
+        if request.if_none_match.contains(etag):
+            rv = app.response_class(status=304)
+        else:
+            rv = make_response(view(*args, **kwargs))
+        rv.set_etag(etag)
+        rv.headers['Cache-Control'] = 'no-cache'
+        return rv
+    return wrapper
+
+
+def stream_page(template, **context):
+    # Stream a read-only page. Teardown runs before a streamed body is sent,
+    # so take the connection out of g and hand it back when the response is
+    # closed. The WSGI server closes it even when the body is never read (HEAD,
+    # early disconnect), and close() shuts the template stream down first.
+    response = app.response_class(stream_template(template, **context))
+    db = g.pop('_database', None)
+    if db is not None:
+        response.call_on_close(lambda: release_db(db))
+    return response
+
+
+def form_fields(*names):
+    # Fetch several stripped form values in one call; missing fields are ''.
+    form = request.form
+    return [form.get(name, '').strip() for name in names]
 
 # ----------------- Routes: Home / Search -----------------
 
-HOME_HTML = """
+# The home page is small and static enough that building it directly is
+# cheaper than a Jinja render. online_search adds the link for apps that
+# serve the search_online route.
+def render_home(online_search=False):
+    messages = ''.join(f'<li>{escape(m)}</li>' for m in get_flashed_messages())
+    online = f' | <a href="{url_for("search_online")}">Search & Add Book</a>' if online_search else ''
+    return f"""
 <!doctype html>
 <title>Library Management</title>
 <h1>Library Management System</h1>
-<p><a href="{{ url_for('list_books') }}">Books</a> | <a href="{{ url_for('list_members') }}">Members</a> | <a href="{{ url_for('list_loans') }}">Loans</a></p>
-<form method="get" action="{{ url_for('search') }}">
-  <input name="q" placeholder="Search books or members" value="{{ request.args.get('q','') }}">
+<p><a href="{url_for('list_books')}">Books</a> | <a href="{url_for('list_members')}">Members</a> | <a href="{url_for('list_loans')}">Loans</a>{online}</p>
+<form method="get" action="{url_for('search')}">
+  <input name="q" placeholder="Search books or members" value="{escape(request.args.get('q',''))}">
   <button>Search</button>
 </form>
 <hr>
-{% with messages = get_flashed_messages() %}
-  {% if messages %}
-    <ul>
-    {% for m in messages %}
-      <li>{{ m }}</li>
-    {% endfor %}
-    </ul>
-  {% endif %}
-{% endwith %}
+{f'<ul>{messages}</ul>' if messages else ''}
 <p>Quick actions:</p>
 <ul>
-  <li><a href="{{ url_for('add_book') }}">Add book</a></li>
-  <li><a href="{{ url_for('add_member') }}">Add member</a></li>
+  <li><a href="{url_for('add_book')}">Add book</a></li>
+  <li><a href="{url_for('add_member')}">Add member</a></li>
 </ul>
 """
 
 @app.route('/')
 def home():
-    return render_template_string(HOME_HTML)
+    return render_home()
+
+def render_search(q, books, members):
+    book_items = ''.join(
+        f'<li>{escape(b["title"])} by {escape(b["author"])} (copies: {b["copies"]}) - <a href="{url_for("edit_book", book_id=b["id"])}">Edit</a></li>'
+        for b in books
+    ) or '<li>No books</li>'
+    member_items = ''.join(
+        f'<li>{escape(m["name"])} ({escape(m["email"])}) - <a href="{url_for("edit_member", member_id=m["id"])}">Edit</a></li>'
+        for m in members
+    ) or '<li>No members</li>'
+    return f"""
+<h2>Search results for "{escape(q)}"</h2>
+<a href="{url_for('home')}">Home</a>
+<h3>Books</h3>
+<ul>{book_items}</ul>
+<h3>Members</h3>
+<ul>{member_items}</ul>
+"""
+
+def fts_query(q):
+    # Quote every word so user input can't break MATCH syntax, and make each
+    # one a prefix match.
+    return ' '.join('"%s"*' % word.replace('"', '""') for word in q.split())
 
 @app.route('/search')
 def search():
@@ -127,22 +320,16 @@ def search():
     books = []
     members = []
     if q:
-        books = query_db("SELECT * FROM books WHERE title LIKE ? OR author LIKE ? OR isbn LIKE ?", (f'%{q}%', f'%{q}%', f'%{q}%'))
-        members = query_db("SELECT * FROM members WHERE name LIKE ? OR email LIKE ?", (f'%{q}%', f'%{q}%'))
-    return render_template_string('''
-    <h2>Search results for "{{ q }}"</h2>
-    <a href="{{ url_for('home') }}">Home</a>
-    <h3>Books</h3>
-    <ul>{% for b in books %}<li>{{ b['title'] }} by {{ b['author'] }} (copies: {{ b['copies'] }}) - <a href="{{ url_for('edit_book', book_id=b['id']) }}">Edit</a></li>{% else %}<li>No books</li>{% endfor %}</ul>
-    <h3>Members</h3>
-    <ul>{% for m in members %}<li>{{ m['name'] }} ({{ m['email'] }}) - <a href="{{ url_for('edit_member', member_id=m['id']) }}">Edit</a></li>{% else %}<li>No members</li>{% endfor %}</ul>
-    ''', q=q, books=books, members=members)
+        match = fts_query(q)
+        books = query_db("SELECT books.* FROM books_fts JOIN books ON books.id = books_fts.rowid WHERE books_fts MATCH ? ORDER BY rank", (match,))
+        members = query_db("SELECT members.* FROM members_fts JOIN members ON members.id = members_fts.rowid WHERE members_fts MATCH ? ORDER BY rank", (match,))
+    return render_search(q, books, members)
 
 # ----------------- Books -----------------
 
 BOOKS_HTML = '''
 <h2>Books</h2>
-<a href="{{ url_for('home') }}">Home</a> | <a href="{{ url_for('add_book') }}">Add Book</a>
+<a href="{{ url_for('home') }}">Home</a> | <a href="{{ url_for('add_book') }}">Add Book</a> | <a href="{{ url_for('import_books') }}">Import CSV</a>
 <ul>
 {% for b in books %}
   <li>
@@ -158,9 +345,10 @@ BOOKS_HTML = '''
 '''
 
 @app.route('/books')
+@etag_cached
 def list_books():
-    books = query_db('SELECT * FROM books ORDER BY title')
-    return render_template_string(BOOKS_HTML, books=books)
+    books = iter_db('SELECT id,title,author,isbn,copies FROM books ORDER BY title')
+    return stream_page('books.html', books=books)
 
 ADD_BOOK_HTML = '''
 <h2>Add Book</h2>
@@ -177,18 +365,20 @@ ADD_BOOK_HTML = '''
 @app.route('/books/add', methods=['GET','POST'])
 def add_book():
     if request.method == 'POST':
-        title = request.form['title'].strip()
-        author = request.form.get('author','').strip()
-        isbn = request.form.get('isbn','').strip() or None
-        copies = int(request.form.get('copies',1))
+        title, author, isbn, copies = form_fields('title', 'author', 'isbn', 'copies')
+        isbn = isbn or None
+        copies = int(copies or 1)
+        if not title:
+            flash('Title is required')
+            return render_template('add_book.html')
         try:
-            execute_db('INSERT INTO books (title,author,isbn,copies) VALUES (?,?,?,?)', (title,author,isbn,copies))
+            execute_db('INSERT INTO books (title,author,isbn,copies) VALUES (:title,:author,:isbn,:copies)', {'title': title, 'author': author, 'isbn': isbn, 'copies': copies})
             flash('Book added')
             return redirect(url_for('list_books'))
         except sqlite3.IntegrityError:
             flash('ISBN must be unique')
 
-    return render_template_string(ADD_BOOK_HTML)
+    return render_template('add_book.html')
 
 EDIT_BOOK_HTML = '''
 <h2>Edit Book</h2>
@@ -209,17 +399,19 @@ def edit_book(book_id):
         flash('Book not found')
         return redirect(url_for('list_books'))
     if request.method == 'POST':
-        title = request.form['title'].strip()
-        author = request.form.get('author','').strip()
-        isbn = request.form.get('isbn','').strip() or None
-        copies = int(request.form.get('copies',1))
+        title, author, isbn, copies = form_fields('title', 'author', 'isbn', 'copies')
+        isbn = isbn or None
+        copies = int(copies or 1)
+        if not title:
+            flash('Title is required')
+            return render_template('edit_book.html', book=book)
         try:
-            execute_db('UPDATE books SET title=?,author=?,isbn=?,copies=? WHERE id=?', (title,author,isbn,copies,book_id))
+            execute_db('UPDATE books SET title=:title,author=:author,isbn=:isbn,copies=:copies WHERE id=:id', {'title': title, 'author': author, 'isbn': isbn, 'copies': copies, 'id': book_id})
             flash('Book updated')
             return redirect(url_for('list_books'))
         except sqlite3.IntegrityError:
             flash('ISBN must be unique')
-    return render_template_string(EDIT_BOOK_HTML, book=book)
+    return render_template('edit_book.html', book=book)
 
 @app.route('/books/<int:book_id>/delete')
 def delete_book(book_id):
@@ -227,8 +419,59 @@ def delete_book(book_id):
     flash('Book deleted (if existed)')
     return redirect(url_for('list_books'))
 
+IMPORT_BOOKS_HTML = '''
+<h2>Import Books</h2>
+<a href="{{ url_for('list_books') }}">Back to books</a>
+<p>CSV with a header row: title,author,isbn,copies. Rows with an existing ISBN are skipped.</p>
+<form method="post" enctype="multipart/form-data">
+  File: <input name="file" type="file" accept=".csv" required><br>
+  <button>Import</button>
+</form>
+'''
+
+@app.route('/books/import', methods=['GET','POST'])
+def import_books():
+    upload = request.files.get('file')
+    if request.method == 'POST' and not upload:
+        flash('Choose a CSV file to import')
+    elif request.method == 'POST':
+        try:
+            rows = []
+            for row in csv.DictReader(io.TextIOWrapper(upload.stream, encoding='utf-8-sig')):
+                title = (row.get('title') or '').strip()
+                if title:
+                    author = (row.get('author') or '').strip()
+                    isbn = (row.get('isbn') or '').strip() or None
+                    rows.append({'title': title, 'author': author, 'isbn': isbn, 'copies': int(row.get('copies') or 1)})
+        except (ValueError, csv.Error):
+            flash('Could not read the CSV file')
+        else:
+            # one transaction for the whole file, committed on teardown
+            added = executemany_db('INSERT OR IGNORE INTO books (title,author,isbn,copies) VALUES (:title,:author,:isbn,:copies)', rows)
+            flash(f'Imported {added} books')
+            return redirect(url_for('list_books'))
+    return render_template('import_books.html')
+
 # ----------------- Members -----------------
 
+# (members_version, rendered <option> list) for the borrow form. The version
+# is read before the members, so a fragment built while a member write was still
+# uncommitted is tagged with the older version and rebuilt on the next visit.
+# Loans and book edits leave members_version alone and keep the fragment.
+_MEMBER_OPTIONS_CACHE = [(None, None)]
+
+def member_options():
+    version = query_db('SELECT version FROM members_version', one=True)['version']
+    cached_version, options = _MEMBER_OPTIONS_CACHE[0]
+    if options is None or cached_version != version:
+        members = query_db('SELECT id,name,email FROM members ORDER BY name')
+        options = Markup(''.join(
+            f'<option value="{m["id"]}">{escape(m["name"])} ({escape(m["email"] or "-")})</option>'
+            for m in members
+        ))
+        _MEMBER_OPTIONS_CACHE[0] = (version, options)
+    return options
+
 MEMBERS_HTML = '''
 <h2>Members</h2>
 <a href="{{ url_for('home') }}">Home</a> | <a href="{{ url_for('add_member') }}">Add Member</a>
@@ -242,9 +485,10 @@ MEMBERS_HTML = '''
 '''
 
 @app.route('/members')
+@etag_cached
 def list_members():
-    members = query_db('SELECT * FROM members ORDER BY name')
-    return render_template_string(MEMBERS_HTML, members=members)
+    members = iter_db('SELECT id,name,email FROM members ORDER BY name')
+    return stream_page('members.html', members=members)
 
 ADD_MEMBER_HTML = '''
 <h2>Add Member</h2>
@@ -259,15 +503,18 @@ ADD_MEMBER_HTML = '''
 @app.route('/members/add', methods=['GET','POST'])
 def add_member():
     if request.method == 'POST':
-        name = request.form['name'].strip()
-        email = request.form.get('email','').strip() or None
+        name, email = form_fields('name', 'email')
+        email = email or None
+        if not name:
+            flash('Name is required')
+            return render_template('add_member.html')
         try:
-            execute_db('INSERT INTO members (name,email) VALUES (?,?)', (name,email))
+            execute_db('INSERT INTO members (name,email) VALUES (:name,:email)', {'name': name, 'email': email})
             flash('Member added')
             return redirect(url_for('list_members'))
         except sqlite3.IntegrityError:
             flash('Email must be unique')
-    return render_template_string(ADD_MEMBER_HTML)
+    return render_template('add_member.html')
 
 EDIT_MEMBER_HTML = '''
 <h2>Edit Member</h2>
@@ -286,15 +533,18 @@ def edit_member(member_id):
         flash('Member not found')
         return redirect(url_for('list_members'))
     if request.method == 'POST':
-        name = request.form['name'].strip()
-        email = request.form.get('email','').strip() or None
+        name, email = form_fields('name', 'email')
+        email = email or None
+        if not name:
+            flash('Name is required')
+            return render_template('edit_member.html', member=member)
         try:
-            execute_db('UPDATE members SET name=?,email=? WHERE id=?', (name,email,member_id))
+            execute_db('UPDATE members SET name=:name,email=:email WHERE id=:id', {'name': name, 'email': email, 'id': member_id})
             flash('Member updated')
             return redirect(url_for('list_members'))
         except sqlite3.IntegrityError:
             flash('Email must be unique')
-    return render_template_string(EDIT_MEMBER_HTML, member=member)
+    return render_template('edit_member.html', member=member)
 
 @app.route('/members/<int:member_id>/delete')
 def delete_member(member_id):
@@ -331,19 +581,19 @@ LOANS_HTML = '''
 
 @app.route('/loans')
 def list_loans():
-    loans = query_db('''
+    loans = iter_db('''
         SELECT loans.id, loans.borrowed_on, loans.returned_on, books.title, members.name
         FROM loans JOIN books ON loans.book_id = books.id
                    JOIN members ON loans.member_id = members.id
         ORDER BY loans.borrowed_on DESC
     ''')
-    return render_template_string(LOANS_HTML, loans=loans)
+    return stream_page('loans.html', loans=loans)
 
 BORROW_HTML = '''
 <h2>Borrow Book</h2>
 <a href="{{ url_for('list_books') }}">Back</a>
 <form method="post">
-  Member: <select name="member_id">{% for m in members %}<option value="{{ m['id'] }}">{{ m['name'] }} ({{ m['email'] or '-' }})</option>{% endfor %}</select><br>
+  Member: <select name="member_id">{{ member_options }}</select><br>
   <button>Borrow</button>
 </form>
 '''
@@ -354,18 +604,16 @@ def borrow_book(book_id):
     if not book:
         flash('Book not found')
         return redirect(url_for('list_books'))
-    members = query_db('SELECT * FROM members ORDER BY name')
     if request.method == 'POST':
         member_id = int(request.form['member_id'])
-        # check copies available: copies - active loans
-        active_loans = query_db('SELECT COUNT(*) as cnt FROM loans WHERE book_id=? AND returned_on IS NULL', (book_id,), one=True)['cnt']
-        if active_loans >= book['copies']:
+        # reserve a copy first; the counter only moves while copies are left
+        if not execute_db('UPDATE books SET on_loan=on_loan+1 WHERE id=:book_id AND on_loan<copies', {'book_id': book_id}):
             flash('No copies available')
             return redirect(url_for('list_books'))
-        execute_db('INSERT INTO loans (book_id,member_id,borrowed_on) VALUES (?,?,?)', (book_id, member_id, datetime.utcnow().isoformat()))
+        execute_db('INSERT INTO loans (book_id,member_id,borrowed_on) VALUES (:book_id,:member_id,:borrowed_on)', {'book_id': book_id, 'member_id': member_id, 'borrowed_on': datetime.utcnow().isoformat()})
         flash('Book borrowed')
         return redirect(url_for('list_loans'))
-    return render_template_string(BORROW_HTML, book=book, members=members)
+    return render_template('borrow.html', book=book, member_options=member_options())
 
 @app.route('/loans/<int:loan_id>/return')
 def return_book(loan_id):
@@ -376,113 +624,91 @@ def return_book(loan_id):
     if loan['returned_on']:
         flash('Already returned')
     else:
-        execute_db('UPDATE loans SET returned_on=? WHERE id=?', (datetime.utcnow().isoformat(), loan_id))
+        if execute_db('UPDATE loans SET returned_on=:returned_on WHERE id=:id AND returned_on IS NULL', {'returned_on': datetime.utcnow().isoformat(), 'id': loan_id}):
+            execute_db('UPDATE books SET on_loan=on_loan-1 WHERE id=:book_id', {'book_id': loan['book_id']})
         flash('Book returned')
     return redirect(url_for('list_loans'))
 
 # ----------------- API endpoints (optional) -----------------
 
+def json_rows(key, query):
+    # Serialise plain tuples keyed by cursor.description instead of going
+    # through sqlite3.Row and Flask's JSON provider for every row.
+    cur = get_db().cursor()
+    cur.row_factory = None
+    cur.execute(query)
+    cols = [d[0] for d in cur.description]
+    data = {key: [dict(zip(cols, row)) for row in cur]}
+    body = orjson.dumps(data) if orjson else json.dumps(data)
+    return app.response_class(body, mimetype='application/json')
+
 @app.route('/api/books')
+@etag_cached
 def api_books():
-    books = query_db('SELECT * FROM books')
-    return {'books': [dict(b) for b in books]}
+    return json_rows('books', 'SELECT id,title,author,isbn,copies FROM books')
 
 @app.route('/api/members')
+@etag_cached
 def api_members():
-    members = query_db('SELECT * FROM members')
-    return {'members': [dict(m) for m in members]}
+    return json_rows('members', 'SELECT id,name,email FROM members')
+
+# ----------------- Templates -----------------
+
+app.jinja_loader = ChoiceLoader([
+    DictLoader({
+        'books.html': BOOKS_HTML,
+        'add_book.html': ADD_BOOK_HTML,
+        'edit_book.html': EDIT_BOOK_HTML,
+        'import_books.html': IMPORT_BOOKS_HTML,
+        'members.html': MEMBERS_HTML,
+        'add_member.html': ADD_MEMBER_HTML,
+        'edit_member.html': EDIT_MEMBER_HTML,
+        'loans.html': LOANS_HTML,
+        'borrow.html': BORROW_HTML,
+    }),
+    app.jinja_loader,
+])
+
+# Templates never change at runtime, so skip the staleness checks and keep
+# compiled bytecode on disk across restarts.
+app.config['TEMPLATES_AUTO_RELOAD'] = False
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
 
 # ----------------- Run -----------------
 
 if __name__ == '__main__':
     app.run(debug=True)
-from flask import Flask, g, request, redirect, url_for, render_template_string, flash
-import sqlite3
-from datetime import datetime
+from flask import Flask, request, redirect, url_for, render_template, flash
+from jinja2 import ChoiceLoader, DictLoader, FileSystemBytecodeCache
 import os
+import time
+from functools import lru_cache
 import requests
 
 DATABASE = 'library.db'
+JINJA_CACHE_DIR = '.jinja_cache'
 app = Flask(__name__)
 app.secret_key = 'replace-with-a-secure-key'
 
 # ----------------- Database helpers -----------------
 
-def get_db():
-    db = getattr(g, '_database', None)
-    if db is None:
-        need_init = not os.path.exists(DATABASE)
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
-        if need_init:
-            init_db(db)
-    return db
-
-
-def init_db(db):
-    cur = db.cursor()
-    cur.executescript('''
-    CREATE TABLE books (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        author TEXT,
-        isbn TEXT UNIQUE,
-        copies INTEGER DEFAULT 1
-    );
-
-    CREATE TABLE members (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        email TEXT UNIQUE
-    );
-
-    CREATE TABLE loans (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        book_id INTEGER NOT NULL,
-        member_id INTEGER NOT NULL,
-        borrowed_on TEXT NOT NULL,
-        returned_on TEXT,
-        FOREIGN KEY(book_id) REFERENCES books(id),
-        FOREIGN KEY(member_id) REFERENCES members(id)
-    );
-    ''')
-    db.commit()
-
-
-@app.teardown_appcontext
-def close_connection(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
-
-# ----------------- Utility functions -----------------
-
-def query_db(query, args=(), one=False):
-    cur = get_db().execute(query, args)
-    rv = cur.fetchall()
-    cur.close()
-    return (rv[0] if rv else None) if one else rv
-
-
-def execute_db(query, args=()):
-    db = get_db()
-    cur = db.cursor()
-    cur.execute(query, args)
-    db.commit()
-    return cur.lastrowid
+# Reuse the pooled connection helpers defined above.
+app.teardown_appcontext(close_connection)
 
 # ----------------- Routes: Home / Search -----------------
 
-HOME_HTML = """
-<!doctype html>
-<title>Library Management</title>
-<h1>Library Management System</h1>
-<p><a href="{{ url_for('list_books') }}">Books</a> | <a href="{{ url_for('list_members') }}">Members</a> | <a href="{{ url_for('list_loans') }}">Loans</a> | <a href="{{ url_for('search_online') }}">Search & Add Book</a></p>
-<form method="get" action="{{ url_for('search') }}">
-  <input name="q" placeholder="Search books or members" value="{{ request.args.get('q','') }}">
+@app.route('/')
+def home():
+    return render_home(online_search=True)
+
+SEARCH_ONLINE_HTML = """
+<h2>Search Books Online</h2>
+<a href="{{ url_for('home') }}">Home</a>
+<form method="get">
+  Query: <input name="q" value="{{ request.args.get('q','') }}">
   <button>Search</button>
 </form>
-<hr>
 {% with messages = get_flashed_messages() %}
   {% if messages %}
     <ul>
@@ -492,69 +718,90 @@ HOME_HTML = """
     </ul>
   {% endif %}
 {% endwith %}
-<p>Quick actions:</p>
-<ul>
-  <li><a href="{{ url_for('add_book') }}">Add book</a></li>
-  <li><a href="{{ url_for('add_member') }}">Add member</a></li>
-</ul>
+{% if books %}
+  <h3>Results:</h3>
+  <ul>
+  {% for b in books %}
+    <li>
+      <strong>{{ b['title'] }}</strong> by {{ b['authors'] }} (ISBN: {{ b['isbn'] or '-' }})
+      <form method="post" style="display:inline;">
+        <input type="hidden" name="title" value="{{ b['title'] }}">
+        <input type="hidden" name="author" value="{{ b['authors'] }}">
+        <input type="hidden" name="isbn" value="{{ b['isbn'] }}">
+        <button>Add to Library</button>
+      </form>
+    </li>
+  {% endfor %}
+  </ul>
+{% endif %}
 """
 
-@app.route('/')
-def home():
-    return render_template_string(HOME_HTML)
+GOOGLE_BOOKS_URL = 'https://www.googleapis.com/books/v1/volumes'
+GOOGLE_BOOKS_CACHE_TTL = 3600
+# seconds; bounds how long a slow lookup can hold a worker thread
+GOOGLE_BOOKS_TIMEOUT = 5
+
+# Keeps the HTTPS connection to Google Books open between searches.
+_SESSION = requests.Session()
+
+@lru_cache(maxsize=1024)
+def _google_books(q, ttl_bucket):
+    # ttl_bucket is part of the cache key, so results expire when it rolls over
+    r = _SESSION.get(GOOGLE_BOOKS_URL, params={'q': q, 'maxResults': 5}, timeout=GOOGLE_BOOKS_TIMEOUT)
+    r.raise_for_status()
+    books = []
+    for item in r.json().get('items', []):
+        volume = item['volumeInfo']
+        books.append({
+            'title': volume.get('title', 'Unknown'),
+            'authors': ', '.join(volume.get('authors', [])),
+            'isbn': next((i['identifier'] for i in volume.get('industryIdentifiers', []) if i['type']=='ISBN_13'), None)
+        })
+    return tuple(books)
+
+def search_google_books(q):
+    return _google_books(q, int(time.time() // GOOGLE_BOOKS_CACHE_TTL))
 
 @app.route('/search_online', methods=['GET', 'POST'])
 def search_online():
-    SEARCH_HTML = """
-    <h2>Search Books Online</h2>
-    <a href="{{ url_for('home') }}">Home</a>
-    <form method="get">
-      Query: <input name="q" value="{{ request.args.get('q','') }}">
-      <button>Search</button>
-    </form>
-    {% if books %}
-      <h3>Results:</h3>
-      <ul>
-      {% for b in books %}
-        <li>
-          <strong>{{ b['title'] }}</strong> by {{ b['authors'] }} (ISBN: {{ b['isbn'] or '-' }})
-          <form method="post" style="display:inline;">
-            <input type="hidden" name="title" value="{{ b['title'] }}">
-            <input type="hidden" name="author" value="{{ b['authors'] }}">
-            <input type="hidden" name="isbn" value="{{ b['isbn'] }}">
-            <button>Add to Library</button>
-          </form>
-        </li>
-      {% endfor %}
-      </ul>
-    {% endif %}
-    """
     books = []
     if request.method == 'POST':
         # Add selected book to library
-        title = request.form['title']
-        author = request.form['author']
-        isbn = request.form.get('isbn') or None
+        title, author, isbn = form_fields('title', 'author', 'isbn')
+        isbn = isbn or None
+        if not title:
+            flash('Title is required')
+            return render_template('search_online.html', books=books)
         try:
-            execute_db('INSERT INTO books (title,author,isbn,copies) VALUES (?,?,?)', (title, author, isbn, 1))
+            execute_db('INSERT INTO books (title,author,isbn,copies) VALUES (:title,:author,:isbn,:copies)', {'title': title, 'author': author, 'isbn': isbn, 'copies': 1})
             flash('Book added to library')
         except Exception as e:
             flash(f'Error adding book: {e}')
-        return redirect(url_for('list_books'))
+        return redirect(url_for('search_online'))
 
     q = request.args.get('q', '').strip()
     if q:
-        r = requests.get('https://www.googleapis.com/books/v1/volumes', params={'q': q, 'maxResults': 5})
-        data = r.json()
-        for item in data.get('items', []):
-            volume = item['volumeInfo']
-            books.append({
-                'title': volume.get('title', 'Unknown'),
-                'authors': ', '.join(volume.get('authors', [])),
-                'isbn': next((i['identifier'] for i in volume.get('industryIdentifiers', []) if i['type']=='ISBN_13'), None)
-            })
-
-    return render_template_string(SEARCH_HTML, books=books)
+        try:
+            books = search_google_books(q)
+        except requests.RequestException as e:
+            flash(f'Online search failed: {e}')
+
+    return render_template('search_online.html', books=books)
+
+# ----------------- Templates -----------------
+
+app.jinja_loader = ChoiceLoader([
+    DictLoader({
+        'search_online.html': SEARCH_ONLINE_HTML,
+    }),
+    app.jinja_loader,
+])
+
+# Templates never change at runtime, so skip the staleness checks and keep
+# compiled bytecode on disk across restarts.
+app.config['TEMPLATES_AUTO_RELOAD'] = False
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
 
 # ----------------- Include all previous LMS routes here -----------------
 # (Books, Members, Loans, API endpoints, etc.)